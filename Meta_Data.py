@@ -15,22 +15,127 @@ y crea mapas interactivos con análisis de riesgos de seguridad.
 
 import os
 import argparse
+import io
 import json
-from datetime import datetime
-from PIL import Image
-from PIL.ExifTags import GPSTAGS, TAGS
+import math
+import re
+import struct
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from itertools import islice
 import gmplot
+import numpy as np
+import piexif
 import csv
 
+# orjson es opcional: sin él los reportes de seguridad usan el módulo json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Pillow solo es necesario para imágenes PNG (piexif no las soporta); sus nombres
+# de tags se usan para los que piexif no conoce
+try:
+    from PIL import Image
+    from PIL.ExifTags import TAGS as PIL_TAGS
+except ImportError:
+    Image = None
+    PIL_TAGS = {}
+
 # Configuración global
 CSV_FILENAME = "metadata_report.csv"
 JSON_FILENAME = "metadata_report.json"
 TXT_FILENAME = "security_analysis.txt"
 MAP_FILENAME = "mapa_ubicaciones.html"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+REPORT_FORMATS = ('csv', 'json', 'txt')
+REPORT_BUFFER_SIZE = 1 << 20  # Escrituras de 1 MB en los reportes
+
+# Fila de los reportes: tupla compacta (sin diccionario por entrada)
+Row = namedtuple('Row', 'filename tag value')
+
+# Entrada del reporte JSON con el mismo formato que json.dump(indent=4)
+JSON_ENTRY = '\n    {{\n        "filename": {},\n        "tag": {},\n        "value": {}\n    }}'
+TXT_ENTRY = "Archivo: {}\nTag: {}\nValor: {}\n" + "-" * 50 + "\n"
+
+# Configuración de concurrencia
+THREAD_WORKERS = 32  # Lectura de metadatos: dominada por I/O
+WRITE_BATCH_SIZE = 64  # Imágenes saneadas acumuladas antes de escribirlas a disco
+REPORT_BATCH_SIZE = 256  # Imágenes cuyas filas se agrupan para convertir sus GPS por lotes
+PREFETCH_PER_WORKER = 4  # Imágenes en vuelo por worker mientras se consumen resultados
 
 # Configuración de riesgo
 RISK_KEYWORDS = ['GPS', 'Location', 'Position', 'Address', 'Copyright', 'Author', 'Artist']
-HIGH_RISK_TAGS = ['GPSLatitude', 'GPSLongitude', 'Copyright', 'Author', 'Artist']
+HIGH_RISK_TAGS = frozenset(['GPSLatitude', 'GPSLongitude', 'Copyright', 'Author', 'Artist'])
+RISK_RE = re.compile('|'.join(map(re.escape, RISK_KEYWORDS)))
+
+# Tags "seguros" que se conservan al sanear
+SAFE_TAGS = ['DateTime', 'ImageWidth', 'ImageLength', 'Make', 'Model', 'Software']
+GPS_INFO_TAG = 34853  # GPSInfo tag ID
+EXIF_IFD_TAG = 34665  # ExifOffset tag ID
+
+# Errores de lectura que se reportan como fila Error de la imagen en lugar de
+# detener el procesamiento del directorio (cabeceras truncadas o mal formadas)
+READ_ERRORS = (OSError, ValueError, TypeError, KeyError, IndexError, struct.error)
+
+# Formato struct de los tipos TIFF numéricos (ASCII y UNDEFINED se leen como bytes)
+TIFF_FORMATS = {
+    piexif.TYPES.Byte: 'B',
+    piexif.TYPES.Short: 'H',
+    piexif.TYPES.Long: 'L',
+    piexif.TYPES.Rational: 'LL',
+    piexif.TYPES.SByte: 'b',
+    piexif.TYPES.SShort: 'h',
+    piexif.TYPES.SLong: 'l',
+    piexif.TYPES.SRational: 'll',
+    piexif.TYPES.Float: 'f',
+    piexif.TYPES.DFloat: 'd',
+}
+TIFF_BYTE_TYPES = (piexif.TYPES.Ascii, piexif.TYPES.Undefined)
+
+# Nombres de tags (IFD 0th y Exif) con la nomenclatura de PIL.ExifTags que
+# ya usaban los reportes donde piexif difiere
+TAGS = {
+    tag_id: info['name']
+    for ifd in ('0th', 'Exif')
+    for tag_id, info in piexif.TAGS[ifd].items()
+}
+TAGS.update({
+    263: 'Thresholding',
+    513: 'JpegIFOffset',
+    514: 'JpegIFByteCount',
+    515: 'JpegRestartInterval',
+    517: 'JpegLosslessPredictors',
+    518: 'JpegPointTransforms',
+    519: 'JpegQTables',
+    520: 'JpegDCTables',
+    521: 'JpegACTables',
+    34665: 'ExifOffset',
+    GPS_INFO_TAG: 'GPSInfo',
+    37396: 'SubjectLocation',
+    37398: 'TIFF/EPStandardID',
+    37520: 'SubsecTime',
+    37521: 'SubsecTimeOriginal',
+    37522: 'SubsecTimeDigitized',
+    37888: 'AmbientTemperature',
+    40960: 'FlashPixVersion',
+    40962: 'ExifImageWidth',
+    40963: 'ExifImageHeight',
+    40965: 'ExifInteroperabilityOffset',
+})
+# Tags que piexif descarta (CompositeImage, NoiseProfile...) con su nombre de Pillow
+for tag_id, name in PIL_TAGS.items():
+    TAGS.setdefault(tag_id, name)
+SAFE_TAG_IDS = frozenset(tag_id for tag_id, name in TAGS.items() if name in SAFE_TAGS)
+
+# Búsqueda de nombres precalculada con cadenas internadas, compartidas por todas las filas
+_TAG_NAME = {tag_id: sys.intern(name) for tag_id, name in TAGS.items()}
+_TAG_GET = _TAG_NAME.get
 
 def convert_decimal_degrees(degree, minutes, seconds, direction):
     """Convierte coordenadas GPS a grados decimales con precisión """
@@ -42,6 +147,24 @@ def convert_decimal_degrees(degree, minutes, seconds, direction):
     except (TypeError, ValueError):
         return None
 
+def convert_batch(degrees, minutes, seconds, negative):
+    """Convierte en bloque coordenadas GPS a grados decimales con precisión"""
+    decimal_degrees = degrees + minutes / 60 + seconds / 3600
+    # Sin redondeo: la precisión de 6 decimales se aplica al formatear el reporte
+    return np.where(negative, -decimal_degrees, decimal_degrees)
+
+@lru_cache(maxsize=None)
+def _batch_kernel():
+    """Compila convert_batch con Numba la primera vez que hay coordenadas que convertir"""
+    # Numba es opcional y se importa bajo demanda: cargarlo al importar el módulo costaría
+    # más que la conversión en cada ejecución (y en cada proceso worker)
+    try:
+        from numba import njit
+    except ImportError:
+        # Sin Numba la conversión se ejecuta como NumPy vectorizado
+        return convert_batch
+    return njit('float64[:](float64[:], float64[:], float64[:], boolean[:])', cache=True)(convert_batch)
+
 def detect_gps_location(gps_info):
     """Detección avanzada de coordenadas GPS con validación"""
     gps_coords = {}
@@ -65,6 +188,57 @@ def detect_gps_location(gps_info):
     except (KeyError, TypeError):
         return None
 
+def parse_gps_record(gps_data):
+    """Extrae (lat_dms, lat_ref, lon_dms, lon_ref) numéricos para la conversión por lotes"""
+    try:
+        lat = tuple(float(v) for v in gps_data["lat"])
+        lon = tuple(float(v) for v in gps_data["lon"])
+    except (TypeError, ValueError):
+        return None
+    
+    # La conversión por lotes exige grados, minutos y segundos en ambas coordenadas
+    if len(lat) != 3 or len(lon) != 3:
+        return None
+    return lat, gps_data["lat_ref"], lon, gps_data["lon_ref"]
+
+def resolve_gps_coordinates(gps_records):
+    """Convierte {clave: registro GPS} a {clave: (lat, lon)} en una sola pasada"""
+    if not gps_records:
+        return {}
+    
+    keys = list(gps_records)
+    records = list(gps_records.values())
+    count = len(records)
+    
+    # Latitudes y longitudes en un único lote: [lat_0..lat_n, lon_0..lon_n]
+    dms = np.array(
+        [r[0] for r in records] + [r[2] for r in records], dtype=np.float64
+    ).reshape(2 * count, 3)
+    negative = np.array(
+        [r[1] in ("S", "W") for r in records] + [r[3] in ("S", "W") for r in records],
+        dtype=np.bool_
+    )
+    decimal = _batch_kernel()(
+        np.ascontiguousarray(dms[:, 0]),
+        np.ascontiguousarray(dms[:, 1]),
+        np.ascontiguousarray(dms[:, 2]),
+        negative
+    )
+    lats, lons = decimal[:count], decimal[count:]
+    valid = np.isfinite(lats) & np.isfinite(lons)
+    
+    return {
+        keys[i]: (float(lats[i]), float(lons[i]))
+        for i in np.flatnonzero(valid)
+    }
+
+def gps_metadata(filename, lat, lon):
+    """Entradas de reporte con las coordenadas decimales y el enlace a Google Maps"""
+    return [
+        Row(filename, 'GPSDecimal', f"{lat:.6f}, {lon:.6f}"),
+        Row(filename, 'GoogleMaps', f"https://maps.google.com/?q={lat:.6f},{lon:.6f}")
+    ]
+
 def analyze_security_risk(metadata, filename):
     """Analiza riesgos de seguridad en los metadatos"""
     risk_report = {
@@ -82,7 +256,7 @@ def analyze_security_risk(metadata, filename):
                 'value': value,
                 'risk': 'ALTO: Información de ubicación o propiedad expuesta'
             })
-        elif any(kw in tag for kw in RISK_KEYWORDS):
+        elif RISK_RE.search(str(tag)):
             risk_report['medium_risk_items'].append({
                 'tag': tag,
                 'value': value,
@@ -107,54 +281,325 @@ def analyze_security_risk(metadata, filename):
     
     return risk_report
 
-def sanitize_metadata(image):
+def sanitize_exif(exif_data, safe_tag_ids=SAFE_TAG_IDS):
     """Elimina metadatos sensibles manteniendo información técnica básica"""
-    # Conservar solo estos tags "seguros"
-    SAFE_TAGS = ['DateTime', 'ImageWidth', 'ImageLength', 'Make', 'Model', 'Software']
+    # GPSInfo nunca está entre los tags seguros, así que los datos GPS se descartan
+    return {tag_id: value for tag_id, value in exif_data.items() if tag_id in safe_tag_ids}
+
+def _rational_to_float(rational):
+    """Convierte un racional (numerador, denominador) de piexif a float"""
+    numerator, denominator = rational
+    return numerator / denominator if denominator else float('nan')
+
+def _is_rational(value):
+    """Indica si el valor es un par (numerador, denominador) de enteros como los de piexif"""
+    return type(value) is tuple and len(value) == 2 and type(value[0]) is int and type(value[1]) is int
+
+def normalize_exif_value(value, value_type):
+    """Convierte valores crudos de piexif al formato que usan los reportes"""
+    if value_type == piexif.TYPES.Ascii and isinstance(value, bytes):
+        return value.rstrip(b'\x00').decode('utf-8', 'replace')
     
-    exif_data = image.getexif() or {}
-    new_exif = {}
+    # El tipo declarado no garantiza el almacenado: un TIFF válido puede guardar
+    # XResolution como SHORT, así que solo se convierten los racionales reales
+    if value_type in (piexif.TYPES.Rational, piexif.TYPES.SRational):
+        if _is_rational(value):
+            return _rational_to_float(value)
+        if type(value) is tuple and value and all(map(_is_rational, value)):
+            return tuple(_rational_to_float(r) for r in value)
+    
+    return value
+
+def _to_text(value):
+    """Texto del valor para el reporte; los bytes con texto se decodifican en lugar de usar su repr"""
+    value_type = type(value)
+    if value_type is str:
+        return value
+    if value_type is bytes:
+        # Los bloques binarios (MakerNote, etc.) conservan su repr escapada
+        try:
+            text = value.rstrip(b'\x00').decode('utf-8')
+        except UnicodeDecodeError:
+            return str(value)
+        return text if text.isprintable() else str(value)
+    return str(value)
+
+def normalize_ifd(ifd, values):
+    """Normaliza los valores crudos de una IFD de piexif ('0th', 'Exif', 'GPS'...)"""
+    ifd_tags = piexif.TAGS[ifd]
+    return {
+        tag_id: normalize_exif_value(value, ifd_tags.get(tag_id, {}).get('type'))
+        for tag_id, value in values.items()
+    }
+
+def flatten_exif(exif_dict):
+    """Aplana las IFD de piexif en {tag_id: valor}, con GPSInfo como sub-diccionario"""
+    exif_data = {}
     
-    # Copiar solo los metadatos considerados seguros
-    for tag_id, value in exif_data.items():
-        tag_name = TAGS.get(tag_id, tag_id)
-        if tag_name in SAFE_TAGS:
-            new_exif[tag_id] = value
+    for ifd in ('0th', 'Exif'):
+        exif_data.update(normalize_ifd(ifd, exif_dict.get(ifd, {})))
     
-    # Eliminar completamente los datos GPS
-    if 34853 in new_exif:  # GPSInfo tag ID
-        del new_exif[34853]
+    # Igual que Pillow, el puntero GPSInfo se sustituye por la sub-IFD GPS
+    if exif_dict.get('GPS'):
+        exif_data[GPS_INFO_TAG] = normalize_ifd('GPS', exif_dict['GPS'])
     
-    return new_exif
+    return exif_data
 
-def export_report(data, format, output_dir):
-    """Exporta el reporte en diferentes formatos"""
+def _open_png(file_path):
+    """Abre un PNG con Pillow, el único formato que piexif no soporta"""
+    if Image is None:
+        raise ValueError("Se requiere Pillow para procesar imágenes PNG")
+    return Image.open(file_path)
+
+def _load_exif(source):
+    """piexif.load con los errores de una cabecera truncada o corrupta convertidos en ValueError"""
+    try:
+        return piexif.load(source)
+    except (struct.error, IndexError, KeyError) as e:
+        raise ValueError(f"EXIF corrupto o truncado: {e}") from e
+
+def _read_app1(file_path):
+    """Lee solo el segmento APP1 Exif de un JPEG (cabecera 'Exif' + bloque TIFF)"""
+    with open(file_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            raise ValueError("Given file is neither JPEG nor TIFF.")
+        
+        while True:
+            header = f.read(4)
+            # Inicio de los datos de imagen (SOS/EOI) o marcador inválido: no hay Exif
+            if len(header) < 4 or header[0] != 0xFF or header[1] in (0xDA, 0xD9):
+                return None
+            
+            length = int.from_bytes(header[2:], 'big') - 2
+            if header[1] == 0xE1:
+                segment = f.read(length)
+                if segment.startswith(b'Exif\x00\x00'):
+                    return segment
+            else:
+                f.seek(length, 1)
+
+def _tiff_header(app1):
+    """Devuelve (bloque TIFF, orden de bytes para struct, offset de la IFD 0th)"""
+    tiff = app1[6:]
+    endian = '<' if tiff[:2] == b'II' else '>'
+    return tiff, endian, struct.unpack_from(endian + 'L', tiff, 4)[0]
+
+def _ifd_entries(tiff, endian, offset):
+    """Entradas de una IFD sin decodificar: {tag_id: (tipo, cantidad, posición del valor)}"""
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    entries = {}
+    for pos in range(offset + 2, offset + 2 + 12 * count, 12):
+        tag_id, value_type, length = struct.unpack_from(endian + 'HHL', tiff, pos)
+        entries[tag_id] = (value_type, length, pos + 8)
+    return entries
+
+def _ifd_value(tiff, endian, value_type, length, pos):
+    """Decodifica una entrada igual que piexif: bytes, enteros o pares racionales"""
+    if value_type in TIFF_BYTE_TYPES:
+        size = length
+    else:
+        fmt = endian + TIFF_FORMATS[value_type] * length
+        size = struct.calcsize(fmt)
+    
+    # Los valores de más de 4 bytes se guardan fuera de la entrada
+    if size > 4:
+        pos = struct.unpack_from(endian + 'L', tiff, pos)[0]
+    
+    if value_type == piexif.TYPES.Ascii:
+        return tiff[pos:pos + length - 1]
+    if value_type == piexif.TYPES.Undefined:
+        return tiff[pos:pos + length]
+    
+    values = struct.unpack_from(fmt, tiff, pos)
+    if value_type in (piexif.TYPES.Rational, piexif.TYPES.SRational):
+        values = tuple(zip(values[::2], values[1::2]))
+    return values[0] if len(values) == 1 else values
+
+def _read_unknown_tags(app1, known):
+    """Recupera del mismo APP1 los tags de las IFD 0th y Exif que piexif.load descarta"""
+    tiff, endian, offset = _tiff_header(app1)
+    entries = _ifd_entries(tiff, endian, offset)
+    if EXIF_IFD_TAG in entries:
+        entries.update(_ifd_entries(tiff, endian, _ifd_value(tiff, endian, *entries[EXIF_IFD_TAG])))
+    
+    # Normalizados con el tipo almacenado: piexif.TAGS no declara ninguno para ellos
+    return {
+        tag_id: normalize_exif_value(_ifd_value(tiff, endian, *entry), entry[0])
+        for tag_id, entry in entries.items()
+        if tag_id not in known and (entry[0] in TIFF_FORMATS or entry[0] in TIFF_BYTE_TYPES)
+    }
+
+def read_exif(file_path):
+    """Lee los metadatos EXIF de la cabecera sin decodificar los píxeles"""
+    if file_path.lower().endswith('.png'):
+        with _open_png(file_path) as img:
+            return img._getexif() or {}
+    
+    # Un solo acceso a la cabecera: piexif y la recuperación de tags parten del mismo APP1
+    app1 = _read_app1(file_path)
+    if app1 is None:
+        return {}
+    
+    exif_data = flatten_exif(_load_exif(app1))
+    exif_data.update(_read_unknown_tags(app1, exif_data))
+    return exif_data
+
+def read_gps(file_path):
+    """Lee solo la sub-IFD GPS, siguiendo el puntero GPSInfo de la IFD 0th"""
+    if file_path.lower().endswith('.png'):
+        with _open_png(file_path) as img:
+            return dict(img.getexif().get_ifd(GPS_INFO_TAG))
+    
+    app1 = _read_app1(file_path)
+    if app1 is None:
+        return {}
+    
+    # Sin pasar por piexif.load: no se decodifican las IFD Exif/Interop/1st ni la miniatura
+    try:
+        tiff, endian, offset = _tiff_header(app1)
+        pointer = _ifd_entries(tiff, endian, offset).get(GPS_INFO_TAG)
+        if pointer is None:
+            return {}
+        
+        entries = _ifd_entries(tiff, endian, _ifd_value(tiff, endian, *pointer))
+        gps_tags = piexif.TAGS['GPS']
+        # Como piexif.load, solo se conservan los tags GPS conocidos
+        gps_info = {
+            tag_id: _ifd_value(tiff, endian, *entry)
+            for tag_id, entry in entries.items() if tag_id in gps_tags
+        }
+    except (struct.error, IndexError, KeyError) as e:
+        raise ValueError(f"EXIF corrupto o truncado: {e}") from e
+    
+    return normalize_ifd('GPS', gps_info)
+
+def sanitize_image(file_path):
+    """Genera la imagen con solo los tags seguros; devuelve (bytes saneados, metadatos resultantes)"""
+    output = io.BytesIO()
+    
+    if file_path.lower().endswith('.png'):
+        with _open_png(file_path) as img:
+            new_exif = Image.Exif()
+            new_exif.update(sanitize_exif(img.getexif()))
+            img.save(output, format='PNG', exif=new_exif)
+        return output.getvalue(), dict(new_exif)
+    
+    with open(file_path, 'rb') as f:
+        image_data = f.read()
+    
+    # piexif interpreta como ruta cualquier dato que no empiece por el marcador SOI:
+    # nunca se le pasan bytes que no sean un JPEG
+    if image_data[:2] != b'\xff\xd8':
+        raise ValueError("Given file is neither JPEG nor TIFF.")
+    
+    # Sustituye el segmento APP1 sin recodificar la imagen
+    exif_dict = {'0th': sanitize_exif(_load_exif(image_data)['0th'])}
+    if exif_dict['0th']:
+        piexif.insert(piexif.dump(exif_dict), image_data, output)
+    else:
+        piexif.remove(image_data, output)
+    
+    return output.getvalue(), flatten_exif(exif_dict)
+
+def _write_file(item):
+    """Escribe una imagen saneada (ruta, bytes) en disco"""
+    file_path, data = item
+    try:
+        with open(file_path, 'wb') as f:
+            f.write(data)
+    except OSError as e:
+        print(f"Error escribiendo {file_path}: {str(e)}")
+
+def write_sanitized(batch, executor=None):
+    """Escribe un lote de imágenes saneadas, en paralelo si se proporciona un executor"""
+    if executor is None:
+        for item in batch:
+            _write_file(item)
+    else:
+        # Las escrituras del lote se solapan entre sí
+        list(executor.map(_write_file, batch))
+    batch.clear()
+
+@contextmanager
+def open_report(format, output_dir):
+    """Abre un reporte en modo streaming y devuelve (ruta, función que escribe filas Row)"""
     if format == 'csv':
         csv_path = os.path.join(output_dir, CSV_FILENAME)
-        with open(csv_path, "w", newline="", encoding='utf-8') as csv_file:
+        with open(csv_path, "w", newline="", encoding='utf-8', buffering=REPORT_BUFFER_SIZE) as csv_file:
             writer = csv.writer(csv_file)
             writer.writerow(["Filename", "Metadata Tag", "Value"])
-            for entry in data:
-                writer.writerow([entry['filename'], entry['tag'], entry['value']])
-        return csv_path
+            
+            def write(entries):
+                writer.writerows(entries)
+            
+            yield csv_path, write
     
     elif format == 'json':
         json_path = os.path.join(output_dir, JSON_FILENAME)
-        with open(json_path, "w", encoding='utf-8') as json_file:
-            json.dump(data, json_file, indent=4)
-        return json_path
+        with open(json_path, "w", encoding='utf-8', buffering=REPORT_BUFFER_SIZE) as json_file:
+            # Lista JSON emitida por bloques; cada campo usa el codificador C de json
+            json_file.write("[")
+            first = True
+            dumps = json.dumps
+            
+            def write(entries):
+                nonlocal first
+                chunk = ",".join(
+                    JSON_ENTRY.format(dumps(filename), dumps(tag), dumps(value))
+                    for filename, tag, value in entries
+                )
+                if chunk:
+                    json_file.write(chunk if first else "," + chunk)
+                    first = False
+            
+            yield json_path, write
+            json_file.write("]" if first else "\n]")
     
     elif format == 'txt':
         txt_path = os.path.join(output_dir, TXT_FILENAME)
-        with open(txt_path, "w", encoding='utf-8') as txt_file:
-            for entry in data:
-                txt_file.write(f"Archivo: {entry['filename']}\n")
-                txt_file.write(f"Tag: {entry['tag']}\n")
-                txt_file.write(f"Valor: {entry['value']}\n")
-                txt_file.write("-" * 50 + "\n")
-        return txt_path
+        with open(txt_path, "w", encoding='utf-8', buffering=REPORT_BUFFER_SIZE) as txt_file:
+            
+            def write(entries):
+                txt_file.write("".join(
+                    TXT_ENTRY.format(*entry) for entry in entries
+                ))
+            
+            yield txt_path, write
     
-    return None
+    else:
+        yield None, lambda entries: None
+
+def _finite(value):
+    """Sustituye los float no finitos (NaN, inf) por None en estructuras anidadas"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    return value
+
+def dump_json(data, path):
+    """Escribe datos como JSON indentado, con orjson si está disponible"""
+    # Los valores no serializables (bytes, racionales de Pillow) se exportan como texto
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(
+                data,
+                default=_to_text,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            ))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            # Igual que orjson, NaN e inf se exportan como null en lugar de JSON inválido
+            json.dump(_finite(data), f, indent=2, ensure_ascii=False, allow_nan=False, default=_to_text)
+    return path
+
+def export_report(data, format, output_dir):
+    """Exporta el reporte en diferentes formatos"""
+    with open_report(format, output_dir) as (report_path, write):
+        write(data)
+    return report_path
 
 def generate_map(gps_data, output_dir):
     """Genera mapa interactivo con marcadores de ubicaciones"""
@@ -165,123 +610,243 @@ def generate_map(gps_data, output_dir):
     first_point = next(iter(gps_data.values()))
     gmap = gmplot.GoogleMapPlotter(first_point[0], first_point[1], 10)
     
-    # Añadir marcadores
-    for filename, (lat, lng) in gps_data.items():
-        gmap.marker(lat, lng, title=filename)
+    # Añadir todos los marcadores en una sola llamada
+    filenames = list(gps_data)
+    lats, lngs = zip(*gps_data.values())
+    gmap.scatter(lats, lngs, color='#FF0000', marker=True, title=filenames)
     
     map_path = os.path.join(output_dir, MAP_FILENAME)
     gmap.draw(map_path)
     return map_path
 
-def process_image(file_path, sanitize=False, risk_analysis=False):
-    """Procesa una imagen individual y extrae sus metadatos"""
+def process_gps_only(file_path, filename):
+    """Ruta rápida: extrae solo las coordenadas GPS de una imagen"""
+    results = []
+    gps_coords = None
+    
+    try:
+        gps_data = detect_gps_location(read_gps(file_path))
+        if gps_data:
+            gps_coords = parse_gps_record(gps_data)
+    except READ_ERRORS as e:
+        print(f"Error procesando {file_path}: {str(e)}")
+        results.append(Row(filename, 'Error', str(e)))
+    
+    return {
+        'metadata': results,
+        'gps': gps_coords,
+        'security_report': None,
+        'sanitized': None
+    }
+
+def _read_unsanitized(file_path):
+    """Carga sin saneamiento; misma forma que sanitize_image: (None, metadatos)"""
+    return None, read_exif(file_path)
+
+def _skip_risk(metadata, filename):
+    """Sustituto de analyze_security_risk cuando no se pide el análisis"""
+    return None
+
+def _process(file_path, filename, load, analyze):
+    """Cuerpo común de las variantes: `load` obtiene los metadatos y `analyze` el reporte de riesgo"""
     results = []
     security_report = None
     gps_coords = None
+    sanitized = None
     
     try:
-        with Image.open(file_path) as img:
-            filename = os.path.basename(file_path)
-            exif_data = img._getexif() or {}
-            
-            # Opción de saneamiento
-            if sanitize:
-                new_exif = sanitize_metadata(img)
-                img.save(file_path, exif=bytes(new_exif))
-                exif_data = new_exif
-            
-            # Procesar metadatos
-            for tag_id, value in exif_data.items():
-                tag_name = TAGS.get(tag_id, tag_id)
-                
-                # Procesamiento especial para GPS
-                if tag_name == "GPSInfo":
-                    gps_data = detect_gps_location(value)
-                    if gps_data:
-                        dec_lat = convert_decimal_degrees(
-                            float(gps_data["lat"][0]), 
-                            float(gps_data["lat"][1]), 
-                            float(gps_data["lat"][2]), 
-                            gps_data["lat_ref"]
-                        )
-                        dec_lon = convert_decimal_degrees(
-                            float(gps_data["lon"][0]), 
-                            float(gps_data["lon"][1]), 
-                            float(gps_data["lon"][2]), 
-                            gps_data["lon_ref"]
-                        )
-                        
-                        if dec_lat and dec_lon:
-                            gps_coords = (dec_lat, dec_lon)
-                            results.append({
-                                'filename': filename,
-                                'tag': 'GPSDecimal',
-                                'value': f"{dec_lat}, {dec_lon}"
-                            })
-                            results.append({
-                                'filename': filename,
-                                'tag': 'GoogleMaps',
-                                'value': f"https://maps.google.com/?q={dec_lat},{dec_lon}"
-                            })
-                
-                # Almacenar todos los metadatos
-                results.append({
-                    'filename': filename,
-                    'tag': tag_name,
-                    'value': str(value)
-                })
-            
-            # Análisis de riesgo si se solicita
-            if risk_analysis:
-                security_report = analyze_security_risk(
-                    {TAGS.get(tag_id, tag_id): value for tag_id, value in exif_data.items()},
-                    filename
-                )
+        # Con saneamiento los bytes se devuelven para escribirlos por lotes
+        sanitized, exif_data = load(file_path)
+        
+        # Nombres de tags resueltos una sola vez para el reporte y el análisis de riesgo
+        named = {_TAG_GET(tag_id, tag_id): value for tag_id, value in exif_data.items()}
+        
+        # Procesamiento especial para GPS
+        if "GPSInfo" in named:
+            gps_data = detect_gps_location(named["GPSInfo"])
+            if gps_data:
+                # La conversión a decimal se hace por lotes en resolve_gps_coordinates
+                gps_coords = parse_gps_record(gps_data)
+        
+        # Almacenar todos los metadatos como filas Row
+        results = [Row(filename, tag_name, _to_text(value)) for tag_name, value in named.items()]
+        
+        security_report = analyze(named, filename)
     
-    except (IOError, OSError, ValueError) as e:
+    except READ_ERRORS as e:
         print(f"Error procesando {file_path}: {str(e)}")
-        results.append({
-            'filename': os.path.basename(file_path),
-            'tag': 'Error',
-            'value': str(e)
-        })
+        results.append(Row(filename, 'Error', str(e)))
     
     return {
         'metadata': results,
         'gps': gps_coords,
-        'security_report': security_report
+        'security_report': security_report,
+        'sanitized': sanitized
     }
 
-def process_directory(path, sanitize=False, risk_analysis=False, output_format='csv'):
+# Variantes especializadas por opciones de la CLI (funciones de módulo: serializables para procesos)
+def _proc_plain(file_path, filename):
+    return _process(file_path, filename, _read_unsanitized, _skip_risk)
+
+def _proc_risk(file_path, filename):
+    return _process(file_path, filename, _read_unsanitized, analyze_security_risk)
+
+def _proc_sanitize(file_path, filename):
+    return _process(file_path, filename, sanitize_image, _skip_risk)
+
+def _proc_both(file_path, filename):
+    return _process(file_path, filename, sanitize_image, analyze_security_risk)
+
+PROCESSORS = {
+    (False, False): _proc_plain,
+    (False, True): _proc_risk,
+    (True, False): _proc_sanitize,
+    (True, True): _proc_both,
+}
+
+def make_processor(sanitize=False, risk_analysis=False, gps_only=False):
+    """Selecciona una vez la variante de procesamiento para las opciones dadas"""
+    # Sin saneamiento ni análisis de riesgo basta con la sub-IFD GPS
+    if gps_only and not (sanitize or risk_analysis):
+        return process_gps_only
+    return PROCESSORS[bool(sanitize), bool(risk_analysis)]
+
+def process_image(file_path, sanitize=False, risk_analysis=False, gps_only=False):
+    """Procesa una imagen individual y extrae sus metadatos"""
+    filename = os.path.basename(file_path)
+    process = make_processor(sanitize, risk_analysis, gps_only)
+    result = process(file_path, filename)
+    
+    # Solo process_directory agrupa las escrituras: aquí la imagen se sanea en disco
+    if result['sanitized'] is not None:
+        write_sanitized([(file_path, result['sanitized'])])
+    
+    # Los procesadores devuelven el registro DMS para la conversión por lotes de
+    # process_directory; aquí se mantienen 'gps' como (lat, lon) decimal y sus filas
+    coords = resolve_gps_coordinates({filename: result['gps']}) if result['gps'] else {}
+    result['gps'] = coords.get(filename)
+    if result['gps']:
+        result['metadata'].extend(gps_metadata(filename, *result['gps']))
+    
+    return result
+
+def iter_images(path):
+    """Genera recursivamente (ruta, nombre) de las imágenes soportadas dentro de un directorio"""
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        # Igual que os.walk: los directorios ilegibles se omiten
+        return
+    
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_images(entry.path)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path, entry.name
+
+def process_concurrently(executor, process, paths, window):
+    """Aplica `process` a (ruta, nombre) con hasta `window` imágenes en vuelo; genera (ruta, nombre, resultado)"""
+    paths = iter(paths)
+    pending = {}
+    
+    def submit(count):
+        for file_path, filename in islice(paths, count):
+            pending[executor.submit(process, file_path, filename)] = (file_path, filename)
+    
+    submit(window)
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        # Reponer la ventana antes de consumir para que las lecturas sigan en curso
+        submit(len(done))
+        for future in done:
+            yield (*pending.pop(future), future.result())
+
+def process_directory(path, sanitize=False, risk_analysis=False, output_format='csv',
+                      batch_size=WRITE_BATCH_SIZE, gps_only=False):
     """Procesa un directorio completo de imágenes"""
     if not os.path.exists(path):
         print("Error: La ruta especificada no existe")
         return None, None, []
     
-    all_metadata = []
     all_gps = {}
     security_reports = []
+    pending_writes = []
+    pending_rows = []
     processed_count = 0
     
-    for root, _, files in os.walk(path):
-        for file in files:
-            if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                file_path = os.path.join(root, file)
-                result = process_image(file_path, sanitize, risk_analysis)
-                
-                if result['metadata']:
-                    all_metadata.extend(result['metadata'])
+    # Saneamiento reescribe imágenes (CPU): procesos; solo lectura (I/O): hilos
+    if sanitize:
+        workers = os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        workers = THREAD_WORKERS
+        executor = ThreadPoolExecutor(max_workers=workers)
+    
+    formats = REPORT_FORMATS if output_format == 'all' else (output_format,)
+    
+    with ExitStack() as stack:
+        # Los reportes se escriben a medida que terminan las imágenes
+        reports = [stack.enter_context(open_report(fmt, path)) for fmt in formats]
+        report_path = reports[0][0]
+        writer = stack.enter_context(ThreadPoolExecutor(max_workers=THREAD_WORKERS)) if sanitize else None
+        
+        written = False
+        
+        def write_metadata(entries):
+            nonlocal written
+            written = True
+            for _, write in reports:
+                write(entries)
+        
+        def flush_rows():
+            # Conversión GPS vectorizada del lote, por ruta: dos imágenes con el mismo nombre
+            # en subdirectorios distintos conservan cada una sus filas GPSDecimal/GoogleMaps
+            coords = resolve_gps_coordinates({
+                file_path: gps for file_path, _, _, gps in pending_rows if gps
+            })
+            for file_path, filename, metadata, _ in pending_rows:
+                if file_path in coords:
+                    lat, lon = coords[file_path]
+                    all_gps[filename] = (lat, lon)
+                    # Las coordenadas decimales van junto al resto de filas de su imagen
+                    metadata = metadata + gps_metadata(filename, lat, lon)
+                if metadata:
+                    write_metadata(metadata)
+            pending_rows.clear()
+        
+        with executor:
+            # El recorrido del directorio y las lecturas se solapan con el procesamiento
+            results = process_concurrently(
+                executor, make_processor(sanitize, risk_analysis, gps_only),
+                iter_images(path), workers * PREFETCH_PER_WORKER
+            )
+            
+            for file_path, filename, result in results:
+                if result['sanitized'] is not None:
+                    pending_writes.append((file_path, result['sanitized']))
+                    if len(pending_writes) >= batch_size:
+                        write_sanitized(pending_writes, writer)
                 
-                if result['gps']:
-                    all_gps[file] = result['gps']
+                if result['metadata'] or result['gps']:
+                    pending_rows.append((file_path, filename, result['metadata'], result['gps']))
+                    if len(pending_rows) >= REPORT_BATCH_SIZE:
+                        flush_rows()
                 
                 if result['security_report']:
                     security_reports.append(result['security_report'])
                 
                 processed_count += 1
+        
+        write_sanitized(pending_writes, writer)
+        flush_rows()
     
-    # Exportar resultados
-    report_path = export_report(all_metadata, output_format, path) if all_metadata else None
+    # Como antes del streaming, sin filas no se deja ningún reporte (solo cabeceras)
+    if not written:
+        for report, _ in reports:
+            if report:
+                os.remove(report)
+        report_path = None
     
     # Generar mapa si hay coordenadas GPS
     map_path = generate_map(all_gps, path) if all_gps else None
@@ -289,9 +854,9 @@ def process_directory(path, sanitize=False, risk_analysis=False, output_format='
     # Exportar reportes de seguridad si existen
     security_report_path = None
     if security_reports:
-        security_report_path = os.path.join(path, "security_analysis.json")
-        with open(security_report_path, "w", encoding="utf-8") as f:
-            json.dump(security_reports, f, indent=4)
+        security_report_path = dump_json(
+            security_reports, os.path.join(path, "security_analysis.json")
+        )
     
     return report_path, map_path, security_report_path, processed_count
 
@@ -309,10 +874,15 @@ def main():
     parser.add_argument('--risk', action='store_true', help='Genera reporte de análisis de riesgos')
     parser.add_argument('--format', choices=['csv', 'json', 'txt', 'all'], default='csv',
                         help='Formato de salida para el reporte (default: csv)')
+    parser.add_argument('--gps-only', action='store_true',
+                        help='Solo extrae coordenadas GPS (reporte y mapa), omitiendo el resto de metadatos; '
+                             'se ignora junto con --sanitize o --risk, que necesitan todos los metadatos')
+    parser.add_argument('--batch-size', type=int, default=WRITE_BATCH_SIZE,
+                        help=f'Imágenes saneadas que se acumulan antes de escribirlas (default: {WRITE_BATCH_SIZE})')
     
     args = parser.parse_args()
     
-    start_time = datetime.now()
+    start_ns = time.perf_counter_ns()
     print(f"\n{'='*50}")
     print("EXIF Geo-Metadata Extractor & Mapper Plus")
     print(f"{'='*50}\n")
@@ -320,7 +890,7 @@ def main():
     # Determinar si es archivo o directorio
     if os.path.isfile(args.path):
         # Procesamiento de archivo individual
-        result = process_image(args.path, args.sanitize, args.risk)
+        result = process_image(args.path, args.sanitize, args.risk, args.gps_only)
         
         if result['metadata']:
             # Crear directorio para reportes
@@ -336,22 +906,22 @@ def main():
                 print(f"- Reporte generado en: {report_path}")
             
             if result['security_report']:
-                security_path = os.path.join(report_dir, "security_analysis.json")
-                with open(security_path, "w", encoding="utf-8") as f:
-                    json.dump([result['security_report']], f, indent=4)
+                security_path = dump_json(
+                    [result['security_report']], os.path.join(report_dir, "security_analysis.json")
+                )
                 print(f"- Reporte de seguridad en: {security_path}")
         else:
             print("No se encontraron metadatos en la imagen")
     else:
         # Procesamiento de directorio
         report_path, map_path, security_path, count = process_directory(
-            args.path, args.sanitize, args.risk, args.format
+            args.path, args.sanitize, args.risk, args.format, args.batch_size, args.gps_only
         )
         
         print(f"\nProcesamiento completado:")
         print(f"- Imágenes procesadas: {count}")
         
-        if args.format == 'all':
+        if report_path and args.format == 'all':
             print(f"- Reporte CSV generado en: {os.path.join(args.path, CSV_FILENAME)}")
             print(f"- Reporte JSON generado en: {os.path.join(args.path, JSON_FILENAME)}")
             print(f"- Reporte TXT generado en: {os.path.join(args.path, TXT_FILENAME)}")
@@ -364,9 +934,9 @@ def main():
         if security_path:
             print(f"- Reporte de seguridad en: {security_path}")
     
-    elapsed = datetime.now() - start_time
-    print(f"\nTiempo total de ejecución: {elapsed.total_seconds():.2f} segundos")
+    elapsed = (time.perf_counter_ns() - start_ns) / 1e9
+    print(f"\nTiempo total de ejecución: {elapsed:.2f} segundos")
     print(f"{'='*50}")
 
-if _name_ == "_main_":
+if __name__ == "__main__":
     main()